@@ -1,4 +1,5 @@
-from flask import Flask, send_file, jsonify, render_template_string, request
+from flask import Flask, send_file, jsonify, render_template_string, request, make_response, redirect
+from werkzeug.datastructures import ContentRange
 import os
 from pathlib import Path
 import logging
@@ -12,6 +13,36 @@ import threading
 import queue
 import time
 import subprocess
+import hashlib
+import mmap
+import sqlite3
+import json
+import re
+import uuid
+import zlib
+import mimetypes
+import unicodedata
+from collections import OrderedDict, deque
+import ctypes
+import ctypes.util
+import struct
+from urllib.parse import quote
+import urllib.request
+import http.client
+from urllib.parse import urlsplit
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.DEBUG)
@@ -23,18 +54,138 @@ zip_progress_lock = Lock()
 @app.before_request
 def log_request_info():
     app.logger.debug('Headers: %s', request.headers)
-    app.logger.debug('Body: %s', request.get_data())
+    # 上传分块直接流式写入磁盘，不能在这里读取整个请求体
+    if not request.path.startswith('/api/upload/'):
+        app.logger.debug('Body: %s', request.get_data())
 
 @app.after_request
 def log_response_info(response):
     """只记录非文件下载的响应"""
-    if not response.direct_passthrough:  # 如果不是文件下载响应
+    if not response.direct_passthrough and not response.is_streamed:  # 如果不是文件下载或流式响应
         app.logger.debug('Response: %s', response.get_data())
     return response
 
 # 设置共享的根目录
 SHARE_DIR = "/mnt/seismic"
 
+# 多个共享根目录：名称 -> 配置（path、checksum_cache、fd_cache_size、max_upload_size、read_only）
+# 为空时只共享 SHARE_DIR；只有一个根目录且未配置节点时URL中不带根目录名
+SHARE_ROOTS = {}
+
+# 联邦模式：其他 file_server 节点地址，前端节点汇总它们的根目录
+PEERS = []
+FEDERATION_MODE = 'redirect'  # redirect：重定向到数据所在节点；proxy：由本节点代理传输
+PEER_REFRESH_INTERVAL = 60  # 刷新节点根目录列表的间隔（秒）
+PEER_TIMEOUT = 10  # 获取节点根目录和目录列表的超时（秒）
+PEER_CONNECT_TIMEOUT = 10  # 代理请求连接节点的超时（秒）
+PEER_READ_TIMEOUT = None  # 代理请求读取数据不设超时：长轮询、SSE、大文件摘要和打包都可能长时间没有数据
+
+# 目录树快照：单根目录时使用 TREE_SNAPSHOT，多根目录在各自配置中用 snapshot 指定，为空则不启用
+TREE_SNAPSHOT = None
+SNAPSHOT_IO_WORKERS = 8  # 后台遍历目录树的并发I/O数
+SNAPSHOT_REFRESH_INTERVAL = 3600  # 快照刷新间隔（秒）
+
+# 快照文件格式（小端）：文件头、按路径排序的目录表、条目表、字符串区
+SNAPSHOT_MAGIC = b'FSTREE01'
+SNAPSHOT_HEADER = struct.Struct('<8sQQQQQd')  # magic、目录数、条目数、目录表/条目表/字符串区偏移、生成时间
+SNAPSHOT_DIR = struct.Struct('<QIQIQd')  # 路径偏移、路径长度、首个条目、条目数、目录总大小、修改时间
+SNAPSHOT_ENTRY = struct.Struct('<QIBQd')  # 名称偏移、名称长度、是否目录、大小、修改时间
+
+# 已加载的快照（根目录名 -> 快照）和本次启动后已实际读取过的目录
+tree_snapshots = {}
+warm_dirs = set()
+tree_snapshots_lock = Lock()
+tree_snapshots_started = False
+snapshot_io_pool = ThreadPoolExecutor(max_workers=SNAPSHOT_IO_WORKERS)
+
+# 节点根目录缓存：根目录名 -> (节点地址, 节点上的路径前缀)
+peer_roots = {}
+peer_root_lists = {}  # 节点地址 -> 最近一次成功获取的根目录列表
+peer_roots_updated = 0
+peer_roots_refreshing = False
+peer_roots_loaded = threading.Event()
+peer_roots_lock = Lock()
+
+# 校验和配置
+CHECKSUM_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checksum_cache.db')
+CHECKSUM_WORKERS = os.cpu_count() or 4
+CHECKSUM_READ_SIZE = 64 * 1024 * 1024  # 每次从mmap中取64MB交给哈希函数
+DEFAULT_CHECKSUM_ALGO = 'sha256'
+CHECKSUM_PERSIST_BATCH = 64  # 每算完多少个摘要写一次缓存
+
+# 校验和计算进程池和持久化缓存
+checksum_pool = None
+checksum_pool_lock = Lock()
+checksum_dbs = {}  # 缓存文件路径 -> 连接，每个根目录可以使用独立的缓存
+checksum_db_lock = Lock()
+
+# 大文件传输配置
+FD_CACHE_SIZE = 64  # 缓存打开的热点文件数量
+TRANSFER_CHUNK_SIZE = 4 * 1024 * 1024  # 每次发送4MB
+READAHEAD_SIZE = 64 * 1024 * 1024  # 预读窗口64MB
+
+# 热点文件的文件描述符和mmap缓存（每个根目录一个LRU）
+open_files = {}
+open_files_lock = Lock()
+
+# 目录变更通知配置
+INOTIFY_MAX_WATCHES = 1024  # 同时监听的目录数量上限
+CHANGE_FEED_HISTORY = 1000  # 每个目录保留的变更记录数
+CHANGE_FEED_TIMEOUT = 25  # 长轮询超时和SSE心跳间隔（秒）
+SERVER_INSTANCE = uuid.uuid4().hex[:8]  # 区分服务重启前后的ETag
+MOUNT_TABLE_TTL = 60  # 挂载表缓存时间（秒）
+# inotify 只能看到本机发起的修改，这些文件系统上的目录不使用监听和目录版本ETag
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', 'ceph',
+                       'glusterfs', 'lustre', 'gpfs', 'ocfs2', 'gfs2', '9p', 'fuse.sshfs'}
+
+# inotify 事件掩码
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# inotify 目录监听状态，变更序号全局递增
+dir_watches = OrderedDict()  # 目录绝对路径 -> 监听信息
+dir_watch_wds = {}  # inotify watch描述符 -> 目录绝对路径
+dir_watches_cond = threading.Condition()
+change_seq = 0
+inotify_fd = None
+inotify_libc = None
+inotify_started = False
+mount_table = None  # [(挂载点, 文件系统类型)]，按挂载点长度倒序
+mount_table_loaded = 0
+
+# 上传配置
+UPLOAD_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload_state')
+UPLOAD_PART_SIZE = 64 * 1024 * 1024  # 默认分块大小64MB
+UPLOAD_STREAM_CHUNK = 1024 * 1024  # 从请求流中每次读取1MB
+UPLOAD_SESSION_TTL = 7 * 24 * 3600  # 超过该时间没有上传分块的会话连同临时文件一起清理（秒）
+UPLOAD_SWEEP_INTERVAL = 3600  # 清理过期上传会话的间隔（秒）
+# 上传临时文件名：.<文件名>.<上传ID>.part，列表、清单、同步和打包中都不包含
+UPLOAD_TEMP_PATTERN = re.compile(r'\..+\.[0-9a-f]{32}\.part\Z', re.S)
+UPLOAD_TEMP_GLOB = '.*.' + '?' * 32 + '.part'
+
+# 增量同步配置
+SYNC_MIN_BLOCK_SIZE = 4 * 1024
+SYNC_MAX_BLOCK_SIZE = 64 * 1024 * 1024
+SYNC_DEFAULT_BLOCK_SIZE = 1024 * 1024
+SYNC_TARGET_BLOCKS = 65536  # 自动选择块大小时，每个文件的签名块数上限
+
+# 上传会话状态（同时持久化到 UPLOAD_STATE_DIR 以支持断点续传）
+upload_sessions = {}
+upload_sessions_lock = Lock()
+upload_sweeper_started = False
+
 # HTML模板
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -299,7 +450,7 @@ HTML_TEMPLATE = """
         </tr>
         {% endif %}
         {% for item in items %}
-        <tr>
+        <tr data-name="{{ item.name }}" data-dir="{{ '1' if item.is_dir else '' }}">
             <td>
                 {% if item.is_dir %}
                     <i class="fas fa-folder folder"></i>
@@ -309,15 +460,15 @@ HTML_TEMPLATE = """
                     {{ item.name }}
                 {% endif %}
             </td>
-            <td>{{ item.size if not item.is_dir else '-' }}</td>
+            <td>{{ item.size if item.size else '-' }}</td>
             <td>{{ item.mtime }}</td>
             <td>
                 {% if item.is_image %}
-                    <a href="#" class="preview-btn" onclick="previewImage('{{ item.download_url }}')">
+                    <a href="#" class="preview-btn" data-preview="image" data-url="{{ item.download_url }}">
                         <i class="fas fa-eye"></i> 预览
                     </a>
                 {% elif item.is_code %}
-                    <a href="#" class="preview-btn" onclick="previewCode('{{ item.download_url }}', '{{ item.name }}')">
+                    <a href="#" class="preview-btn" data-preview="code" data-url="{{ item.download_url }}">
                         <i class="fas fa-code"></i> 预览
                     </a>
                 {% endif %}
@@ -376,7 +527,7 @@ HTML_TEMPLATE = """
                 return row.querySelector('.fa-image') !== null;
             }).map(row => {
                 return {
-                    url: row.querySelector('.preview-btn').getAttribute('onclick').match(/'([^']+)'/)[1],
+                    url: row.querySelector('.preview-btn').dataset.url,
                     name: row.querySelector('td:first-child').textContent.trim(),
                     size: row.querySelector('td:nth-child(2)').textContent.trim(),
                     time: row.querySelector('td:nth-child(3)').textContent.trim()
@@ -394,11 +545,11 @@ HTML_TEMPLATE = """
         function showCurrentImage() {
             const currentImage = imageItems[currentImageIndex];
             modalImg.src = currentImage.url;
-            imageInfo.innerHTML = `
-                <div>${currentImage.name}</div>
-                <div>大小: ${currentImage.size} | 修改时间: ${currentImage.time}</div>
-                <div>${currentImageIndex + 1} / ${imageItems.length}</div>
-            `;
+            imageInfo.replaceChildren(
+                createElement('div', currentImage.name),
+                createElement('div', `大小: ${currentImage.size} | 修改时间: ${currentImage.time}`),
+                createElement('div', `${currentImageIndex + 1} / ${imageItems.length}`)
+            );
         }
 
         function navigateImage(direction) {
@@ -562,6 +713,107 @@ HTML_TEMPLATE = """
                 closeCodeModal();
             }
         });
+
+        function createElement(tag, text, attrs) {
+            const element = document.createElement(tag);
+            if (text) {
+                element.textContent = text;
+            }
+            Object.entries(attrs || {}).forEach(([name, value]) => element.setAttribute(name, value));
+            return element;
+        }
+
+        function createIcon(className) {
+            return createElement('i', '', {class: className});
+        }
+
+        // 预览按钮通过 data 属性携带地址，服务端渲染和动态插入的行共用同一个事件处理
+        document.querySelector('table').addEventListener('click', function(e) {
+            const button = e.target.closest('.preview-btn');
+            if (!button) {
+                return;
+            }
+            e.preventDefault();
+            if (button.dataset.preview === 'image') {
+                previewImage(button.dataset.url);
+            } else {
+                previewCode(button.dataset.url, button.closest('tr').dataset.name);
+            }
+        });
+
+        // 根据条目信息生成表格行，与服务端模板保持一致（只用 DOM 接口构造，不拼接 HTML）
+        function renderRow(item) {
+            const row = document.createElement('tr');
+            row.dataset.name = item.name;
+            row.dataset.dir = item.is_dir ? '1' : '';
+
+            const nameCell = createElement('td');
+            if (item.is_dir) {
+                nameCell.append(createIcon('fas fa-folder folder'), ' ',
+                                createElement('a', item.name, {href: item.url}));
+            } else {
+                nameCell.append(createIcon(`fas fa-${item.is_image ? 'image' : 'file'} file`), ' ', item.name);
+            }
+
+            const actions = createElement('td');
+            if (item.is_image || item.is_code) {
+                const preview = createElement('a', '', {
+                    href: '#',
+                    class: 'preview-btn',
+                    'data-preview': item.is_image ? 'image' : 'code',
+                    'data-url': item.download_url
+                });
+                preview.append(createIcon(item.is_image ? 'fas fa-eye' : 'fas fa-code'), ' 预览');
+                actions.append(preview, ' ');
+            }
+            const download = createElement('a', '', {href: item.download_url, class: 'download-btn'});
+            download.append(createIcon('fas fa-download'), ' 下载');
+            actions.append(download);
+
+            row.append(nameCell,
+                       createElement('td', item.size ? String(item.size) : '-'),
+                       createElement('td', String(item.mtime)),
+                       actions);
+            return row;
+        }
+
+        // 将变更应用到当前列表：目录在前，文件在后，按名称排序
+        function applyChange(change) {
+            const rows = Array.from(document.querySelectorAll('tr[data-name]'));
+            const existing = rows.find(row => row.dataset.name === change.name);
+            if (existing) {
+                existing.remove();
+            }
+            if (change.type === 'removed' || !change.item) {
+                return;
+            }
+
+            const row = renderRow(change.item);
+            const key = (change.item.is_dir ? '0' : '1') + change.item.name.toLowerCase();
+            const next = rows.find(other => other !== existing &&
+                ((other.dataset.dir ? '0' : '1') + other.dataset.name.toLowerCase()) > key);
+            if (next) {
+                next.parentNode.insertBefore(row, next);
+            } else {
+                document.querySelector('table tbody').appendChild(row);
+            }
+        }
+
+        // 订阅当前目录的变更推送，只更新变化的条目
+        {% if change_seq is not none %}
+        if (window.EventSource) {
+            const changeSource = new EventSource('/api/changes/{{ current_path|urlencode }}?since={{ change_seq }}');
+            changeSource.onmessage = function(e) {
+                const data = JSON.parse(e.data);
+                if (data.reset) {
+                    changeSource.close();
+                    location.reload();
+                    return;
+                }
+                data.changes.forEach(applyChange);
+            };
+        }
+        {% endif %}
     </script>
 </body>
 </html>
@@ -595,20 +847,775 @@ def is_code_file(filename):
     }
     return os.path.splitext(filename.lower())[1] in code_extensions
 
+def load_config(config_path):
+    """从JSON配置文件加载根目录和联邦节点配置"""
+    global SHARE_DIR, SHARE_ROOTS, PEERS, FEDERATION_MODE, TREE_SNAPSHOT
+    with open(config_path) as f:
+        config = json.load(f)
+    SHARE_DIR = config.get('share_dir', SHARE_DIR)
+    TREE_SNAPSHOT = config.get('snapshot', TREE_SNAPSHOT)
+    SHARE_ROOTS = config.get('roots', SHARE_ROOTS)
+    PEERS = config.get('peers', PEERS)
+    FEDERATION_MODE = config.get('federation_mode', FEDERATION_MODE)
+    for name, root in SHARE_ROOTS.items():
+        if not name or '/' in name:
+            raise ValueError(f"无效的根目录名: {name!r}")
+        root['path'] = os.path.abspath(root['path'])
+    if FEDERATION_MODE not in ('redirect', 'proxy'):
+        raise ValueError(f"无效的联邦模式: {FEDERATION_MODE}")
+
+def get_share_roots():
+    """返回本地共享根目录 {名称: 配置}"""
+    if SHARE_ROOTS:
+        return SHARE_ROOTS
+    return {os.path.basename(SHARE_DIR.rstrip('/')) or 'root': {'path': SHARE_DIR, 'snapshot': TREE_SNAPSHOT}}
+
+def roots_mounted():
+    """多个根目录或联邦模式下，URL第一级为根目录名"""
+    return len(SHARE_ROOTS) > 1 or bool(PEERS)
+
+def split_share_path(filepath):
+    """拆分请求路径，返回 (根目录名, 根目录配置, 根目录内的相对路径)，根目录不存在时返回None"""
+    roots = get_share_roots()
+    if not roots_mounted():
+        name, root = next(iter(roots.items()))
+        return name, root, filepath
+    name, _, rest = filepath.partition('/')
+    if name not in roots:
+        return None
+    return name, roots[name], rest
+
+def find_root(full_path):
+    """返回包含该绝对路径的根目录 (名称, 配置)"""
+    matches = [
+        (name, root) for name, root in get_share_roots().items()
+        if os.path.commonpath([full_path, root['path']]) == root['path']
+    ]
+    return max(matches, key=lambda match: len(match[1]['path']))
+
+def resolve_share_path(filepath):
+    """将请求路径解析为共享目录下的绝对路径，越界或根目录不存在时返回None"""
+    parts = split_share_path(filepath)
+    if parts is None:
+        return None
+    root_dir = parts[1]['path']
+    full_path = os.path.abspath(os.path.join(root_dir, parts[2]))
+    if not os.path.commonpath([full_path, root_dir]) == root_dir:
+        return None
+    return full_path
+
+def parent_inside_root(full_path):
+    """解析符号链接后，路径所在目录是否仍在其根目录内（写入前检查，防止经由共享目录内的符号链接写到外面）"""
+    root_dir = os.path.realpath(find_root(full_path)[1]['path'])
+    parent = os.path.realpath(os.path.dirname(full_path))
+    return os.path.commonpath([parent, root_dir]) == root_dir
+
+def to_share_path(full_path):
+    """将绝对路径转换为请求路径（resolve_share_path 的逆操作）"""
+    name, root = find_root(full_path)
+    relative_path = os.path.relpath(full_path, root['path'])
+    if relative_path == '.':
+        relative_path = ''
+    if not roots_mounted():
+        return relative_path
+    return f'{name}/{relative_path}' if relative_path else name
+
+def refresh_peer_roots():
+    """向各节点获取根目录列表，获取失败的节点沿用上次的结果"""
+    global peer_roots, peer_roots_updated, peer_roots_refreshing
+
+    def fetch(peer_url):
+        with urllib.request.urlopen(f"{peer_url.rstrip('/')}/api/roots", timeout=PEER_TIMEOUT) as response:
+            return json.load(response)['roots']
+
+    try:
+        fetched = {}
+        with ThreadPoolExecutor(max_workers=len(PEERS)) as executor:
+            for peer_url, future in [(peer_url, executor.submit(fetch, peer_url)) for peer_url in PEERS]:
+                try:
+                    fetched[peer_url] = future.result()
+                except Exception as e:
+                    app.logger.error(f"获取节点根目录失败: {peer_url}: {str(e)}")
+        local_roots = get_share_roots()
+        with peer_roots_lock:
+            peer_root_lists.update(fetched)
+            roots = {}
+            for peer_url in PEERS:
+                for root in peer_root_lists.get(peer_url, []):
+                    roots.setdefault(root['name'], (peer_url.rstrip('/'), root['prefix']))
+            peer_roots = {name: peer for name, peer in roots.items() if name not in local_roots}
+            peer_roots_updated = time.time()
+    finally:
+        with peer_roots_lock:
+            peer_roots_refreshing = False
+        peer_roots_loaded.set()
+
+def get_peer_roots():
+    """获取各节点的根目录 {根目录名: (节点地址, 路径前缀)}
+
+    首次调用时等待获取完成，之后缓存过期时在后台刷新，请求不会被节点阻塞
+    """
+    global peer_roots_refreshing
+    if not PEERS:
+        return peer_roots
+    with peer_roots_lock:
+        refresh = not peer_roots_refreshing and time.time() - peer_roots_updated >= PEER_REFRESH_INTERVAL
+        if refresh:
+            peer_roots_refreshing = True
+    if refresh:
+        threading.Thread(target=refresh_peer_roots, daemon=True).start()
+    if not peer_roots_loaded.is_set():
+        peer_roots_loaded.wait(PEER_TIMEOUT + 1)
+    return peer_roots
+
+def find_peer(filepath):
+    """路径属于其他节点时返回 (根目录名, 节点地址, 节点上的路径前缀, 根目录内的相对路径)，否则返回None"""
+    if not PEERS:
+        return None
+    name, _, rest = filepath.partition('/')
+    if name in get_share_roots():
+        return None
+    peer = get_peer_roots().get(name)
+    if peer is None:
+        return None
+    peer_url, prefix = peer
+    return name, peer_url, prefix, rest
+
+def proxy_to_peer(url):
+    """将当前请求代理到其他节点，流式转发响应"""
+    headers = {
+        key: request.headers[key]
+        for key in ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since', 'Accept', 'Last-Event-ID', 'Content-Type')
+        if key in request.headers
+    }
+    data = request.get_data() if request.method in ('POST', 'PUT') else None
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(parts.netloc, timeout=PEER_CONNECT_TIMEOUT)
+    try:
+        # 连接使用较短的超时，之后的读取按 PEER_READ_TIMEOUT
+        connection.connect()
+        connection.sock.settimeout(PEER_READ_TIMEOUT)
+        connection.request(request.method, path, body=data, headers=headers)
+        upstream = connection.getresponse()
+    except TimeoutError as e:
+        connection.close()
+        app.logger.error(f"代理请求超时: {url}: {str(e)}")
+        return jsonify({'error': '节点响应超时'}), 504
+    except (OSError, http.client.HTTPException) as e:
+        connection.close()
+        app.logger.error(f"代理请求失败: {url}: {str(e)}")
+        return jsonify({'error': f'节点不可用: {str(e)}'}), 502
+
+    def generate():
+        try:
+            while True:
+                # read1 有数据就返回，SSE 等流式响应不会被缓冲
+                chunk = upstream.read1(TRANSFER_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        except (OSError, http.client.HTTPException) as e:
+            app.logger.error(f"代理传输中断: {url}: {str(e)}")
+
+    response = app.response_class(generate(), status=upstream.status)
+    for key in ('Content-Type', 'Content-Length', 'Content-Range', 'Content-Disposition', 'Accept-Ranges',
+                'ETag', 'Last-Modified', 'Cache-Control'):
+        if key in upstream.headers:
+            response.headers[key] = upstream.headers[key]
+    response.call_on_close(connection.close)
+    return response
+
+@app.before_request
+def forward_to_peer():
+    """联邦模式下，将属于其他节点根目录的API请求重定向或代理到该节点
+
+    目录列表（页面和 /api/files）由本节点汇总，不在这里转发。
+    """
+    if not PEERS or not request.view_args or request.endpoint in ('index', 'list_files'):
+        return None
+    for key in ('filepath', 'dirpath', 'subpath'):
+        if key in request.view_args:
+            filepath = request.view_args[key]
+            break
+    else:
+        return None
+
+    peer = find_peer(filepath)
+    if peer is None:
+        return None
+    _, peer_url, prefix, rest = peer
+    base = request.path[:len(request.path) - len(filepath)] if filepath else request.path
+    url = peer_url + quote(base + prefix + rest)
+    if request.query_string:
+        url += '?' + request.query_string.decode()
+
+    app.logger.debug(f"转发到节点: {url}")
+    if FEDERATION_MODE == 'proxy':
+        return proxy_to_peer(url)
+    return redirect(url, code=307)
+
+def make_item(name, relative_path, is_dir, size, mtime):
+    """生成目录列表中单个条目的信息"""
+    return {
+        'name': name,
+        'is_dir': is_dir,
+        'is_image': not is_dir and is_image_file(name),
+        'is_code': not is_dir and is_code_file(name),  # 添加代码文件判断
+        'url': f'/{relative_path}' if is_dir else None,
+        'size': get_human_size(size) if not is_dir else None,
+        'mtime': get_file_time(mtime),
+        'download_url': f'/api/download/{relative_path}',
+        'path': relative_path
+    }
+
+def is_upload_temp(name):
+    """判断是否为分块上传的临时文件"""
+    return UPLOAD_TEMP_PATTERN.match(name) is not None
+
+def build_item(current_dir, name):
+    """读取文件信息并生成列表条目"""
+    full_path = os.path.join(current_dir, name)
+    stat = os.stat(full_path)
+    return make_item(name, to_share_path(full_path), os.path.isdir(full_path), stat.st_size, stat.st_mtime)
+
+def scan_directory(root_path, relpath):
+    """读取单个目录，返回 (修改时间, [(名称, 是否目录, 大小, 修改时间)], 需要继续遍历的子目录)"""
+    full_path = os.path.join(root_path, relpath)
+    mtime = os.stat(full_path).st_mtime
+    entries = []
+    subdirs = []
+    with os.scandir(full_path) as it:
+        for entry in it:
+            if is_upload_temp(entry.name):
+                continue
+            try:
+                is_dir = entry.is_dir()
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((entry.name, is_dir, 0 if is_dir else stat.st_size, stat.st_mtime))
+            # 不进入符号链接指向的目录，避免循环和越出共享目录
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(os.path.join(relpath, entry.name))
+    entries.sort()
+    return mtime, entries, subdirs
+
+def scan_tree(folder_path):
+    """实时遍历目录树，返回 [(相对路径, 是否目录, 大小, 修改时间)]"""
+    entries = []
+    pending = ['']
+    while pending:
+        reldir = pending.pop()
+        try:
+            _, dir_entries, subdirs = scan_directory(folder_path, reldir)
+        except OSError as e:
+            if not reldir:
+                raise
+            app.logger.debug(f"跳过无法读取的目录: {reldir}: {str(e)}")
+            continue
+        entries.extend((os.path.join(reldir, name), is_dir, size, mtime)
+                       for name, is_dir, size, mtime in dir_entries)
+        pending.extend(subdirs)
+    entries.sort()
+    return entries
+
+def crawl_tree(root_path):
+    """以有限的并发遍历整个目录树，返回 {相对路径: (修改时间, 条目列表)}"""
+    dirs = {}
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_IO_WORKERS) as executor:
+        pending = {executor.submit(scan_directory, root_path, ''): ''}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                relpath = pending.pop(future)
+                try:
+                    mtime, entries, subdirs = future.result()
+                except OSError as e:
+                    app.logger.debug(f"跳过无法读取的目录: {relpath}: {str(e)}")
+                    continue
+                dirs[relpath] = (mtime, entries)
+                warm_dirs.add(os.path.normpath(os.path.join(root_path, relpath)))
+                for subdir in subdirs:
+                    pending[executor.submit(scan_directory, root_path, subdir)] = subdir
+    return dirs
+
+def write_snapshot(snapshot_path, dirs, created=None):
+    """将目录树写入快照文件（先写临时文件再原子替换），created 为开始遍历的时间"""
+    # 自底向上累计目录总大小
+    total_sizes = {}
+    for relpath in sorted(dirs, key=lambda path: path.count('/') + bool(path), reverse=True):
+        total_sizes[relpath] = sum(
+            total_sizes.get(os.path.join(relpath, name), 0) if is_dir else size
+            for name, is_dir, size, _ in dirs[relpath][1]
+        )
+
+    strings = bytearray()
+    dir_records = bytearray()
+    entry_records = bytearray()
+    n_entries = 0
+    for relpath in sorted(dirs, key=os.fsencode):
+        mtime, entries = dirs[relpath]
+        path_bytes = os.fsencode(relpath)
+        dir_records += SNAPSHOT_DIR.pack(len(strings), len(path_bytes), n_entries, len(entries),
+                                         total_sizes[relpath], mtime)
+        strings += path_bytes
+        for name, is_dir, size, entry_mtime in entries:
+            name_bytes = os.fsencode(name)
+            entry_records += SNAPSHOT_ENTRY.pack(len(strings), len(name_bytes), is_dir, size, entry_mtime)
+            strings += name_bytes
+        n_entries += len(entries)
+
+    dirs_off = SNAPSHOT_HEADER.size
+    entries_off = dirs_off + len(dir_records)
+    strings_off = entries_off + len(entry_records)
+    # 多个进程（如 gunicorn 的多个 worker）可能同时刷新同一个快照，临时文件按进程区分
+    temp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(dirs), n_entries, dirs_off, entries_off, strings_off,
+                                      time.time() if created is None else created))
+        f.write(dir_records)
+        f.write(entry_records)
+        f.write(strings)
+    os.replace(temp_path, snapshot_path)
+
+def load_snapshot(snapshot_path):
+    """通过mmap加载快照文件，文件不存在、被截断或格式不对时返回None"""
+    try:
+        with open(snapshot_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, n_dirs, n_entries, dirs_off, entries_off, strings_off, created = SNAPSHOT_HEADER.unpack_from(mm, 0)
+    except struct.error:
+        magic = None
+    # 各区域必须依次排列且都在文件范围内，之后读取记录时只需检查记录内的偏移
+    if (magic != SNAPSHOT_MAGIC
+            or dirs_off < SNAPSHOT_HEADER.size
+            or dirs_off + n_dirs * SNAPSHOT_DIR.size > entries_off
+            or entries_off + n_entries * SNAPSHOT_ENTRY.size > strings_off
+            or strings_off > len(mm)):
+        app.logger.error(f"无效的快照文件: {snapshot_path}")
+        mm.close()
+        return None
+    return {'mm': mm, 'n_dirs': n_dirs, 'n_entries': n_entries, 'dirs_off': dirs_off,
+            'entries_off': entries_off, 'strings_off': strings_off, 'created': created}
+
+def snapshot_string(snapshot, offset, length):
+    """读取快照字符串区中的一段，超出文件范围时说明快照已损坏"""
+    start = snapshot['strings_off'] + offset
+    if start + length > len(snapshot['mm']):
+        raise ValueError("快照字符串偏移超出文件范围")
+    return snapshot['mm'][start:start + length]
+
+def snapshot_find_dir(snapshot, relpath):
+    """在快照中二分查找目录，返回目录记录或None"""
+    mm = snapshot['mm']
+    target = os.fsencode(relpath)
+    lo, hi = 0, snapshot['n_dirs']
+    while lo < hi:
+        mid = (lo + hi) // 2
+        record = SNAPSHOT_DIR.unpack_from(mm, snapshot['dirs_off'] + mid * SNAPSHOT_DIR.size)
+        path = snapshot_string(snapshot, record[0], record[1])
+        if path == target:
+            return record
+        if path < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return None
+
+def snapshot_list_dir(snapshot, relpath):
+    """从快照中读取目录条目 [(名称, 是否目录, 大小, 修改时间)]，目录不在快照中时返回None"""
+    record = snapshot_find_dir(snapshot, relpath)
+    if record is None:
+        return None
+    if record[2] + record[3] > snapshot['n_entries']:
+        raise ValueError("快照条目范围超出条目表")
+    mm = snapshot['mm']
+    entries = []
+    for i in range(record[2], record[2] + record[3]):
+        name_off, name_len, is_dir, size, mtime = SNAPSHOT_ENTRY.unpack_from(
+            mm, snapshot['entries_off'] + i * SNAPSHOT_ENTRY.size)
+        entries.append((os.fsdecode(snapshot_string(snapshot, name_off, name_len)), bool(is_dir), size, mtime))
+    return entries
+
+def snapshot_scan_tree(snapshot, relpath):
+    """从快照中列出目录树，格式同 scan_tree，目录不在快照中时返回None"""
+    if snapshot_find_dir(snapshot, relpath) is None:
+        return None
+    entries = []
+    pending = [relpath]
+    while pending:
+        reldir = pending.pop()
+        # 符号链接指向的目录没有被遍历，不在快照中
+        for name, is_dir, size, mtime in snapshot_list_dir(snapshot, reldir) or []:
+            path = os.path.join(reldir, name)
+            entries.append((os.path.relpath(path, relpath) if relpath else path, is_dir, size, mtime))
+            if is_dir:
+                pending.append(path)
+    entries.sort()
+    return entries
+
+def get_tree_entries(full_path):
+    """获取目录树条目，返回 (条目列表, 生成时间)
+
+    有快照时直接从快照读取，生成时间为快照开始遍历的时间，之后的修改在下次增量同步中返回
+    """
+    snapshot, relpath = get_snapshot_dir(full_path)
+    if snapshot is not None:
+        try:
+            entries = snapshot_scan_tree(snapshot, relpath)
+        except (ValueError, struct.error) as e:
+            app.logger.error(f"读取目录树快照失败: {full_path}: {str(e)}")
+            entries = None
+        if entries is not None:
+            return entries, snapshot['created']
+    generated = time.time()
+    return scan_tree(full_path), generated
+
+def run_snapshot_crawler(root_name, root):
+    """后台定期遍历根目录并刷新快照"""
+    while True:
+        try:
+            started = time.time()
+            dirs = crawl_tree(root['path'])
+            write_snapshot(root['snapshot'], dirs, started)
+            snapshot = load_snapshot(root['snapshot'])
+            with tree_snapshots_lock:
+                tree_snapshots[root_name] = snapshot
+            app.logger.info(f"目录树快照已更新: {root['path']}，{len(dirs)} 个目录，耗时 {time.time() - started:.1f} 秒")
+        except Exception as e:
+            app.logger.error(f"更新目录树快照失败: {root['path']}: {str(e)}")
+        time.sleep(SNAPSHOT_REFRESH_INTERVAL)
+
+def start_tree_snapshots():
+    """加载已有的快照并启动后台遍历线程（首次调用时执行）"""
+    global tree_snapshots_started
+    with tree_snapshots_lock:
+        if tree_snapshots_started:
+            return
+        tree_snapshots_started = True
+        for root_name, root in get_share_roots().items():
+            if not root.get('snapshot'):
+                continue
+            snapshot = load_snapshot(root['snapshot'])
+            if snapshot is not None:
+                tree_snapshots[root_name] = snapshot
+            threading.Thread(target=run_snapshot_crawler, args=(root_name, root), daemon=True).start()
+
+def get_snapshot_dir(full_path):
+    """返回 (快照, 快照中的相对路径)，所在根目录没有快照时返回 (None, None)"""
+    start_tree_snapshots()
+    root_name, root = find_root(full_path)
+    snapshot = tree_snapshots.get(root_name)
+    if snapshot is None:
+        return None, None
+    relpath = os.path.relpath(full_path, root['path'])
+    return snapshot, '' if relpath == '.' else relpath
+
+def get_snapshot_items(current_dir):
+    """从快照生成目录列表，目录不在快照中或快照损坏时返回None"""
+    snapshot, relpath = get_snapshot_dir(current_dir)
+    if snapshot is None:
+        return None
+    try:
+        entries = snapshot_list_dir(snapshot, relpath)
+    except (ValueError, struct.error) as e:
+        app.logger.error(f"读取目录树快照失败: {current_dir}: {str(e)}")
+        return None
+    if entries is None:
+        return None
+    base = to_share_path(current_dir)
+    return [
+        make_item(name, f'{base}/{name}' if base else name, is_dir, size, mtime)
+        for name, is_dir, size, mtime in entries
+    ]
+
+def get_snapshot_dir_size(full_path):
+    """从快照中获取目录总大小，没有快照或快照损坏时返回None"""
+    snapshot, relpath = get_snapshot_dir(full_path)
+    if snapshot is None:
+        return None
+    try:
+        record = snapshot_find_dir(snapshot, relpath)
+    except (ValueError, struct.error) as e:
+        app.logger.error(f"读取目录树快照失败: {full_path}: {str(e)}")
+        return None
+    return record[4] if record is not None else None
+
+def warm_directory(current_dir):
+    """在后台实际读取目录，之后的请求改用实时列表"""
+    def scan():
+        try:
+            for name in os.listdir(current_dir):
+                try:
+                    os.stat(os.path.join(current_dir, name))
+                except OSError:
+                    pass
+        except OSError:
+            pass
+        warm_dirs.add(current_dir)
+    snapshot_io_pool.submit(scan)
+
+def build_root_items():
+    """多根目录模式下的顶层列表：本地和其他节点的根目录"""
+    items = []
+    for name, root in get_share_roots().items():
+        items.append({
+            'name': name,
+            'is_dir': True,
+            'is_image': False,
+            'is_code': False,
+            'url': f'/{name}',
+            'size': None,
+            'mtime': get_file_time(os.stat(root['path']).st_mtime),
+            'download_url': f'/api/download/{name}',
+            'path': name
+        })
+    for name in get_peer_roots():
+        items.append({
+            'name': name,
+            'is_dir': True,
+            'is_image': False,
+            'is_code': False,
+            'url': f'/{name}',
+            'size': None,
+            'mtime': '-',
+            'download_url': f'/api/download/{name}',
+            'path': name
+        })
+    items.sort(key=lambda x: x['name'].lower())
+    return items
+
+def fetch_peer_items(name, peer_url, prefix, rest):
+    """获取其他节点的目录列表，并将条目路径转换为本节点的路径"""
+    peer_path = (prefix + rest).strip('/')
+    url = f"{peer_url}/api/files/{quote(peer_path)}" if peer_path else f"{peer_url}/api/files"
+    with urllib.request.urlopen(url, timeout=PEER_TIMEOUT) as response:
+        data = json.load(response)
+
+    items = []
+    for item in data['items']:
+        # 节点上的路径前缀替换为根目录名
+        relative_path = f"{name}/{item['path'][len(prefix):]}"
+        item.update({
+            'url': f'/{relative_path}' if item['is_dir'] else None,
+            'download_url': f'/api/download/{relative_path}',
+            'path': relative_path
+        })
+        items.append(item)
+    return items
+
+def start_inotify():
+    """初始化inotify并启动事件读取线程，系统不支持时返回False（需持有 dir_watches_cond）"""
+    global inotify_fd, inotify_libc, inotify_started
+    if inotify_started:
+        return inotify_fd is not None
+    inotify_started = True
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (OSError, AttributeError) as e:
+        app.logger.warning(f"当前系统不支持inotify: {str(e)}")
+        return False
+    if fd < 0:
+        app.logger.warning(f"初始化inotify失败: {os.strerror(ctypes.get_errno())}")
+        return False
+
+    inotify_libc, inotify_fd = libc, fd
+    threading.Thread(target=read_inotify_events, daemon=True).start()
+    return True
+
+def reset_watch(watch):
+    """使监听目录的历史失效，客户端需要重新加载（需持有 dir_watches_cond）"""
+    global change_seq
+    change_seq += 1
+    watch['seq'] = watch['floor'] = change_seq
+    watch['changes'].clear()
+
+def get_filesystem_type(full_path):
+    """返回路径所在挂载点的文件系统类型，无法确定时返回None"""
+    global mount_table, mount_table_loaded
+    if mount_table is None or time.time() - mount_table_loaded > MOUNT_TABLE_TTL:
+        try:
+            with open('/proc/self/mounts') as f:
+                mounts = []
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 3:
+                        # 挂载点中的空格等字符以八进制转义
+                        mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1])
+                        mounts.append((mount_point, fields[2]))
+        except OSError:
+            mounts = []
+        mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+        mount_table, mount_table_loaded = mounts, time.time()
+
+    real_path = os.path.realpath(full_path)
+    for mount_point, fs_type in mount_table:
+        if real_path == mount_point or real_path.startswith(mount_point.rstrip('/') + '/'):
+            return fs_type
+    return None
+
+def watch_directory(full_path):
+    """开始（或继续）监听目录变更，系统或文件系统不支持时返回None"""
+    if get_filesystem_type(full_path) in NETWORK_FILESYSTEMS:
+        return None
+    with dir_watches_cond:
+        if not start_inotify():
+            return None
+
+        watch = dir_watches.get(full_path)
+        if watch is not None:
+            dir_watches.move_to_end(full_path)
+            return watch
+
+        wd = inotify_libc.inotify_add_watch(inotify_fd, os.fsencode(full_path), WATCH_MASK)
+        if wd < 0:
+            app.logger.error(f"监听目录失败: {full_path}: {os.strerror(ctypes.get_errno())}")
+            return None
+        if wd in dir_watch_wds:
+            # 同一目录通过不同路径（如符号链接）访问时共用监听
+            return dir_watches[dir_watch_wds[wd]]
+
+        watch = {'wd': wd, 'seq': change_seq, 'floor': change_seq, 'changes': deque(), 'listeners': 0}
+        dir_watches[full_path] = watch
+        dir_watch_wds[wd] = full_path
+
+        # 超出上限时移除最久未访问且没有客户端等待的监听
+        for path, old_watch in list(dir_watches.items()):
+            if len(dir_watches) <= INOTIFY_MAX_WATCHES:
+                break
+            if old_watch['listeners'] == 0 and path != full_path:
+                inotify_libc.inotify_rm_watch(inotify_fd, old_watch['wd'])
+                del dir_watches[path]
+                del dir_watch_wds[old_watch['wd']]
+                reset_watch(old_watch)
+        return watch
+
+def record_change(wd, mask, name):
+    """记录一条inotify事件（需持有 dir_watches_cond）"""
+    global change_seq
+    if mask & IN_Q_OVERFLOW:
+        # 事件队列溢出，所有目录的历史都不可信
+        for watch in dir_watches.values():
+            reset_watch(watch)
+        return
+
+    path = dir_watch_wds.get(wd)
+    if path is None:
+        return
+    watch = dir_watches[path]
+
+    if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+        # 目录本身被删除或移动
+        reset_watch(watch)
+        if mask & IN_MOVE_SELF:
+            inotify_libc.inotify_rm_watch(inotify_fd, wd)
+        if mask & IN_IGNORED:
+            del dir_watch_wds[wd]
+            dir_watches.pop(path, None)
+        return
+    if not name or is_upload_temp(name):
+        return
+
+    if mask & (IN_DELETE | IN_MOVED_FROM):
+        change_type = 'removed'
+    elif mask & (IN_CREATE | IN_MOVED_TO):
+        change_type = 'added'
+    else:
+        change_type = 'modified'
+
+    change_seq += 1
+    watch['seq'] = change_seq
+    changes = watch['changes']
+    # 持续写入的文件会产生大量修改事件，合并为一条
+    if change_type == 'modified' and changes and changes[-1][1] == name and changes[-1][2] != 'removed':
+        change_type = changes.pop()[2]
+    changes.append((change_seq, name, change_type))
+    if len(changes) > CHANGE_FEED_HISTORY:
+        watch['floor'] = changes.popleft()[0]
+
+def read_inotify_events():
+    """inotify事件读取线程"""
+    while True:
+        try:
+            data = os.read(inotify_fd, 64 * 1024)
+        except OSError as e:
+            app.logger.error(f"读取inotify事件失败: {str(e)}")
+            return
+
+        with dir_watches_cond:
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+                offset += 16 + length
+                record_change(wd, mask, os.fsdecode(name))
+            dir_watches_cond.notify_all()
+
+def wait_for_changes(current_dir, watch, since, timeout):
+    """等待目录在 since 之后的变更，超时返回None
+
+    变更按文件名合并，reset 为 True 表示历史已丢失，客户端需要重新加载列表。
+    """
+    with dir_watches_cond:
+        watch['listeners'] += 1
+        try:
+            dir_watches_cond.wait_for(lambda: watch['seq'] != since, timeout)
+        finally:
+            watch['listeners'] -= 1
+        seq = watch['seq']
+        if seq == since:
+            return None
+        reset = since < watch['floor'] or since > seq
+        latest = {}
+        if not reset:
+            for change in watch['changes']:
+                if change[0] > since:
+                    latest[change[1]] = change[2]
+
+    changes = []
+    for name, change_type in latest.items():
+        item = None
+        if change_type != 'removed':
+            try:
+                item = build_item(current_dir, name)
+            except OSError:
+                change_type = 'removed'
+        changes.append({'type': change_type, 'name': name, 'item': item})
+    return {'seq': seq, 'reset': reset, 'changes': changes}
+
+def get_subdir_mtimes(current_dir, names=None):
+    """返回子目录的修改时间 {名称: mtime_ns}，未指定名称时列出全部子目录，读取失败时返回None"""
+    try:
+        if names is None:
+            with os.scandir(current_dir) as it:
+                names = [entry.name for entry in it if entry.is_dir() and not is_upload_temp(entry.name)]
+        return {name: os.stat(os.path.join(current_dir, name)).st_mtime_ns for name in names}
+    except OSError:
+        return None
+
+def directory_etag(current_dir, seq, subdir_mtimes):
+    """目录版本ETag：目录本身的inode/修改时间、inotify序号、子目录修改时间和快照生成时间
+
+    子目录内的增删只改变子目录自身的修改时间，父目录的监听收不到；
+    列表中的文件夹大小来自快照，快照更新后也要重新生成页面
+    """
+    dir_stat = os.stat(current_dir)
+    snapshot, _ = get_snapshot_dir(current_dir)
+    version = json.dumps([sorted(subdir_mtimes.items()), snapshot['created'] if snapshot else None])
+    digest = hashlib.md5(version.encode()).hexdigest()[:12]
+    return f'{SERVER_INSTANCE}-{dir_stat.st_ino:x}-{dir_stat.st_mtime_ns:x}-{seq}-{digest}'
+
 @app.route('/')
 @app.route('/<path:subpath>')
 def index(subpath=''):
     """显示文件列表页面"""
-    # 构建当前完整路径
-    current_dir = os.path.join(SHARE_DIR, subpath)
-    
-    # 安全检查
-    if not os.path.commonpath([os.path.abspath(current_dir), SHARE_DIR]) == SHARE_DIR:
-        return "访问被拒绝", 403
-    
-    if not os.path.exists(current_dir):
-        return "目录不存在", 404
-
     # 生成面包屑导航
     breadcrumbs = []
     path_parts = subpath.split('/') if subpath else []
@@ -624,26 +1631,82 @@ def index(subpath=''):
     # 获取父目录URL
     parent_url = '/' + os.path.dirname(subpath) if subpath else '/'
 
+    # 多根目录模式的顶层列表，以及其他节点上的目录
+    peer = find_peer(subpath)
+    if peer is not None or (roots_mounted() and not subpath.strip('/')):
+        try:
+            items = fetch_peer_items(*peer) if peer is not None else build_root_items()
+        except Exception as e:
+            return f"Error: {str(e)}", 500
+        return render_template_string(
+            HTML_TEMPLATE,
+            items=items,
+            current_path=subpath,
+            breadcrumbs=breadcrumbs,
+            parent_url=parent_url,
+            change_seq=None
+        )
+
+    # 构建当前完整路径
+    current_dir = resolve_share_path(subpath)
+    
+    # 安全检查
+    if current_dir is None:
+        return "访问被拒绝", 403
+    
+    if not os.path.exists(current_dir):
+        return "目录不存在", 404
+
+    # 目录版本ETag：有inotify监听时只需stat目录本身和上次列出的子目录，未变化的刷新直接返回304
+    # 网络文件系统上其他主机的修改收不到通知，不做监听，退回到下面按条目信息生成的ETag
+    watch = watch_directory(current_dir) if os.path.isdir(current_dir) else None
+    etag = None
+    change_seq_at_listing = None
+    if watch is not None:
+        with dir_watches_cond:
+            change_seq_at_listing = watch['seq']
+            # 序号未变说明子目录集合也没有变化
+            subdirs = watch.get('subdirs') if watch.get('subdirs_seq') == change_seq_at_listing else None
+        subdir_mtimes = get_subdir_mtimes(current_dir, subdirs) if subdirs is not None else None
+        if subdir_mtimes is not None:
+            etag = directory_etag(current_dir, change_seq_at_listing, subdir_mtimes)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+        etag = None
+
+    # 重启后目录缓存还是冷的：先用目录树快照响应，同时在后台读取实际目录
+    items = None
+    if current_dir not in warm_dirs:
+        items = get_snapshot_items(current_dir)
+    from_snapshot = items is not None
+    if from_snapshot:
+        warm_directory(current_dir)
+
     # 获取目录内容
-    items = []
     try:
-        for name in sorted(os.listdir(current_dir)):
-            full_path = os.path.join(current_dir, name)
-            relative_path = os.path.relpath(full_path, SHARE_DIR)
-            is_dir = os.path.isdir(full_path)
-            stat = os.stat(full_path)
-            
-            item = {
-                'name': name,
-                'is_dir': is_dir,
-                'is_image': not is_dir and is_image_file(name),
-                'is_code': not is_dir and is_code_file(name),  # 添加代码文件判断
-                'url': f'/{relative_path}' if is_dir else None,
-                'size': get_human_size(stat.st_size) if not is_dir else None,
-                'mtime': get_file_time(stat.st_mtime),
-                'download_url': f'/api/download/{relative_path}'
-            }
-            items.append(item)
+        if not from_snapshot:
+            # 先于列表读取子目录的修改时间，列表只会比ETag新，不会把过时的页面缓存下来
+            if watch is not None:
+                subdir_mtimes = get_subdir_mtimes(current_dir)
+                if subdir_mtimes is not None:
+                    etag = directory_etag(current_dir, change_seq_at_listing, subdir_mtimes)
+                    with dir_watches_cond:
+                        watch['subdirs'] = list(subdir_mtimes)
+                        watch['subdirs_seq'] = change_seq_at_listing
+            items = []
+            for name in sorted(os.listdir(current_dir)):
+                if not is_upload_temp(name):
+                    items.append(build_item(current_dir, name))
+            warm_dirs.add(current_dir)
+
+        # 快照中有目录总大小时显示文件夹大小
+        for item in items:
+            if item['is_dir']:
+                dir_size = get_snapshot_dir_size(os.path.join(current_dir, item['name']))
+                if dir_size is not None:
+                    item['size'] = get_human_size(dir_size)
         
         # 排序：目录在前，文件在后
         items.sort(key=lambda x: (not x['is_dir'], x['name'].lower()))
@@ -651,16 +1714,128 @@ def index(subpath=''):
     except Exception as e:
         return f"Error: {str(e)}", 500
 
-    return render_template_string(
+    # 没有inotify时根据条目信息生成ETag，至少省去页面渲染和传输
+    if etag is None and not from_snapshot:
+        etag = SERVER_INSTANCE + '-' + hashlib.md5(json.dumps(items).encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+    response = make_response(render_template_string(
         HTML_TEMPLATE,
         items=items,
         current_path=subpath,
         breadcrumbs=breadcrumbs,
-        parent_url=parent_url
-    )
+        parent_url=parent_url,
+        change_seq=change_seq_at_listing
+    ))
+    # 快照中的列表可能已过时，不设置ETag，下次刷新时返回实时列表
+    if not from_snapshot:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/changes/', defaults={'subpath': ''}, methods=['GET'])
+@app.route('/api/changes/<path:subpath>', methods=['GET'])
+def get_changes(subpath):
+    """目录变更推送：Accept 为 text/event-stream 时使用SSE，否则为长轮询"""
+    current_dir = resolve_share_path(subpath)
+    if current_dir is None:
+        app.logger.error(f"无效的访问路径: {subpath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    if not os.path.isdir(current_dir):
+        return jsonify({'error': '目录不存在'}), 404
+
+    watch = watch_directory(current_dir)
+    if watch is None:
+        return jsonify({'error': '当前系统不支持目录变更通知'}), 501
+
+    # 断线重连时浏览器会带上最后收到的事件ID
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        with dir_watches_cond:
+            since = watch['seq']
+
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        data = wait_for_changes(current_dir, watch, since, CHANGE_FEED_TIMEOUT)
+        return jsonify(data or {'seq': since, 'reset': False, 'changes': []})
+
+    def generate(since):
+        with dir_watches_cond:
+            watch['listeners'] += 1
+        try:
+            while True:
+                data = wait_for_changes(current_dir, watch, since, CHANGE_FEED_TIMEOUT)
+                if data is None:
+                    # 心跳，便于及时发现客户端断开
+                    yield ': keepalive\n\n'
+                    continue
+                since = data['seq']
+                yield f"id: {since}\ndata: {json.dumps(data)}\n\n"
+                if data['reset']:
+                    return
+        finally:
+            with dir_watches_cond:
+                watch['listeners'] -= 1
+
+    response = app.response_class(generate(since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/roots', methods=['GET'])
+def get_roots():
+    """本节点的根目录列表，供联邦模式的前端节点汇总"""
+    return jsonify({
+        'roots': [
+            {'name': name, 'prefix': f'{name}/' if roots_mounted() else ''}
+            for name in get_share_roots()
+        ]
+    })
+
+@app.route('/api/files', defaults={'subpath': ''}, methods=['GET'])
+@app.route('/api/files/<path:subpath>', methods=['GET'])
+def list_files(subpath):
+    """获取目录列表（JSON）"""
+    if roots_mounted() and not subpath.strip('/'):
+        return jsonify({'path': '', 'items': build_root_items()})
+
+    peer = find_peer(subpath)
+    if peer is not None:
+        try:
+            return jsonify({'path': subpath, 'items': fetch_peer_items(*peer)})
+        except Exception as e:
+            app.logger.error(f"获取节点目录列表出错: {str(e)}")
+            return jsonify({'error': str(e)}), 502
+
+    current_dir = resolve_share_path(subpath)
+    if current_dir is None:
+        app.logger.error(f"无效的访问路径: {subpath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    if not os.path.isdir(current_dir):
+        return jsonify({'error': '目录不存在'}), 404
 
-def create_zip_file(folder_path, base_path):
-    """使用tar命令创建文件夹的打包文件"""
+    # 与列表页面相同：冷目录先用快照响应（联邦前端节点也经由此接口汇总其他节点的列表）
+    items = None
+    if current_dir not in warm_dirs:
+        items = get_snapshot_items(current_dir)
+    if items is not None:
+        warm_directory(current_dir)
+    else:
+        try:
+            items = [build_item(current_dir, name) for name in os.listdir(current_dir) if not is_upload_temp(name)]
+        except Exception as e:
+            app.logger.error(f"获取目录列表出错: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+        warm_dirs.add(current_dir)
+    items.sort(key=lambda x: (not x['is_dir'], x['name'].lower()))
+    return jsonify({'path': subpath, 'items': items})
+
+def create_zip_file(folder_path, base_path, manifest_algo=None):
+    """使用tar命令创建文件夹的打包文件，指定 manifest_algo 时附带摘要清单"""
     app.logger.debug(f"开始打包文件夹: {folder_path}")
     temp_dir = tempfile.mkdtemp()
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -671,10 +1846,12 @@ def create_zip_file(folder_path, base_path):
     task_id = str(int(time.time() * 1000))
     
     try:
-        # 获取文件夹大小作为进度参考
-        total_size = sum(os.path.getsize(os.path.join(dirpath, filename))
-                        for dirpath, _, filenames in os.walk(folder_path)
-                        for filename in filenames)
+        # 获取文件夹大小作为进度参考，有目录树快照时无需遍历
+        total_size = get_snapshot_dir_size(folder_path)
+        if total_size is None:
+            total_size = sum(os.path.getsize(os.path.join(dirpath, filename))
+                            for dirpath, _, filenames in os.walk(folder_path)
+                            for filename in filenames)
         
         # 初始化进度信息
         with zip_progress_lock:
@@ -689,7 +1866,7 @@ def create_zip_file(folder_path, base_path):
         try:
             # 使用tar命令打包文件夹，不压缩
             process = subprocess.Popen(
-                ['tar', '-cf', archive_path, '.'],
+                ['tar', '-cf', archive_path, f'--exclude={UPLOAD_TEMP_GLOB}', '.'],
                 cwd=folder_path,  # 直接在目标文件夹中执行命令
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE
@@ -716,6 +1893,20 @@ def create_zip_file(folder_path, base_path):
                 error_message = stderr.decode() if stderr else "未知错误"
                 raise Exception(f"打包失败: {error_message}")
             
+            # 追加摘要清单成员，未变化的文件直接使用缓存的摘要
+            if manifest_algo:
+                manifest_name = f'MANIFEST.{manifest_algo}'
+                with open(os.path.join(temp_dir, manifest_name), 'w') as f:
+                    f.write(format_manifest(*build_manifest(folder_path, manifest_algo)))
+                result = subprocess.run(
+                    ['tar', '-rf', archive_path, '-C', temp_dir, f'./{manifest_name}'],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                )
+                if result.returncode != 0:
+                    error_message = result.stderr.decode() if result.stderr else "未知错误"
+                    raise Exception(f"写入清单失败: {error_message}")
+            
         except Exception as e:
             app.logger.error(f"打包过程出错: {str(e)}")
             raise
@@ -761,6 +1952,158 @@ def get_zip_progress(task_id):
             'percent': (progress['processed_size'] / progress['total_size'] * 100) if progress['total_size'] > 0 else 0
         })
 
+def close_open_file(entry):
+    """关闭缓存的文件描述符"""
+    os.close(entry['fd'])
+
+def evict_open_file(entry):
+    """将文件移出缓存，仍在传输中的文件等传输结束后再关闭（需持有 open_files_lock）"""
+    entry['evicted'] = True
+    if entry['refs'] == 0:
+        close_open_file(entry)
+
+def acquire_open_file(path):
+    """从所在根目录的LRU缓存获取已打开的文件，文件变化或未缓存时重新打开"""
+    stat = os.stat(path)
+    key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    root_name, root = find_root(path)
+    with open_files_lock:
+        cache = open_files.setdefault(root_name, OrderedDict())
+        entry = cache.get(path)
+        if entry is not None and entry['key'] == key:
+            cache.move_to_end(path)
+            entry['refs'] += 1
+            return entry
+
+    # 不使用mmap：处理任务会原地改写共享目录中的文件，文件在传输中被截断时访问mmap会触发SIGBUS
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except Exception:
+        os.close(fd)
+        raise
+    entry = {'key': key, 'fd': fd, 'stat': stat, 'refs': 1, 'evicted': False}
+
+    with open_files_lock:
+        if path in cache:
+            evict_open_file(cache.pop(path))
+        cache[path] = entry
+        while len(cache) > root.get('fd_cache_size', FD_CACHE_SIZE):
+            _, oldest = cache.popitem(last=False)
+            evict_open_file(oldest)
+    return entry
+
+def release_open_file(entry):
+    """传输结束后释放文件引用"""
+    with open_files_lock:
+        entry['refs'] -= 1
+        if entry['evicted'] and entry['refs'] == 0:
+            close_open_file(entry)
+
+def readahead(entry, offset, length):
+    """提示内核预读即将发送的数据"""
+    if hasattr(os, 'posix_fadvise') and length > 0:
+        os.posix_fadvise(entry['fd'], offset, min(length, READAHEAD_SIZE), os.POSIX_FADV_WILLNEED)
+
+def send_large_file(path, download_name):
+    """大文件传输：支持 sendfile 时交给服务器零拷贝发送，否则在缓存的描述符上用 pread 分块发送"""
+    entry = acquire_open_file(path)
+    try:
+        stat = entry['stat']
+        size = stat.st_size
+        etag = f'{stat.st_ino:x}-{size:x}-{stat.st_mtime_ns:x}'
+
+        if request.if_none_match.contains(etag):
+            release_open_file(entry)
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        start, stop, status = 0, size, 200
+        # If-Range 不匹配时忽略 Range，返回完整文件
+        if_range = request.if_range
+        range_valid = (
+            'If-Range' not in request.headers
+            or if_range.etag == etag
+            or (if_range.date is not None and if_range.date.timestamp() >= int(stat.st_mtime))
+        )
+        if request.range and range_valid:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                release_open_file(entry)
+                response = app.response_class(status=416)
+                response.content_range = ContentRange('bytes', None, None, size)
+                return response
+            start, stop = byte_range
+            status = 206
+        readahead(entry, start, stop - start)
+
+        # 只有发送到文件末尾时才交给 wsgi.file_wrapper，避免服务器发送超出范围的数据
+        mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        f = None
+        if file_wrapper is not None and request.scheme == 'http' and stop == size:
+            # sendfile 依赖文件当前偏移量，不能与其他请求共享描述符，这里单独打开
+            f = open(path, 'rb')
+            try:
+                sendfile_stat = os.fstat(f.fileno())
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                f.seek(start)
+            except Exception:
+                f.close()
+                raise
+            if (sendfile_stat.st_dev, sendfile_stat.st_ino, sendfile_stat.st_size,
+                    sendfile_stat.st_mtime_ns) != entry['key']:
+                # 两次打开之间文件被替换或修改，响应头描述的是缓存的文件，改用缓存的描述符发送
+                f.close()
+                f = None
+        if f is not None:
+            response = app.response_class(
+                file_wrapper(f, TRANSFER_CHUNK_SIZE),
+                status=status,
+                mimetype=mimetype,
+                direct_passthrough=True
+            )
+            release_open_file(entry)
+        else:
+            # 开发服务器、TLS 等无法使用 sendfile 的情况：pread 按偏移读取，共享描述符也互不影响
+            def generate():
+                for offset in range(start, stop, TRANSFER_CHUNK_SIZE):
+                    length = min(TRANSFER_CHUNK_SIZE, stop - offset)
+                    if (offset - start) % READAHEAD_SIZE == 0:
+                        readahead(entry, offset + READAHEAD_SIZE, stop - offset - READAHEAD_SIZE)
+                    chunk = os.pread(entry['fd'], length, offset)
+                    if chunk:
+                        yield chunk
+                    if len(chunk) < length:
+                        # 文件在传输过程中被截断，提前结束
+                        app.logger.error(f"文件在传输过程中被截断: {path}")
+                        return
+
+            # 非 direct_passthrough 的响应在关闭时才会执行 call_on_close 回调
+            response = app.response_class(generate(), status=status, mimetype=mimetype)
+            response.call_on_close(lambda: release_open_file(entry))
+    except Exception:
+        release_open_file(entry)
+        raise
+
+    response.content_length = stop - start
+    if status == 206:
+        response.content_range = ContentRange('bytes', start, stop, size)
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = stat.st_mtime
+    try:
+        download_name.encode('ascii')
+        names = {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='')}"}
+    response.headers.set('Content-Disposition', 'attachment', **names)
+    return response
+
 @app.route('/api/download/<path:filepath>', methods=['GET'])
 def download_file(filepath):
     """下载指定文件或文件夹"""
@@ -768,28 +2111,27 @@ def download_file(filepath):
     zip_path = None
     
     try:
-        full_path = os.path.join(SHARE_DIR, filepath)
+        full_path = resolve_share_path(filepath)
         app.logger.debug(f"请求下载: {full_path}")
         
+        if full_path is None:
+            app.logger.error(f"无效的访问路径: {filepath}")
+            return jsonify({'error': '无效的文件路径'}), 403
+            
         if not os.path.exists(full_path):
             app.logger.error(f"文件不存在: {full_path}")
             return jsonify({'error': '文件或目录不存在'}), 404
-            
-        if not os.path.commonpath([os.path.abspath(full_path), SHARE_DIR]) == SHARE_DIR:
-            app.logger.error(f"无效的访问路径: {full_path}")
-            return jsonify({'error': '无效的文件路径'}), 403
         
         if os.path.isfile(full_path):
             app.logger.debug("开始文件下载")
             filename = os.path.basename(full_path)
-            return send_file(
-                full_path,
-                as_attachment=True,
-                download_name=filename
-            )
+            return send_large_file(full_path, filename)
         elif os.path.isdir(full_path):
             app.logger.debug("开始文件夹打包下载")
-            archive_path, task_id = create_zip_file(full_path, os.path.dirname(full_path))
+            manifest_algo = request.args.get('manifest')
+            if manifest_algo and manifest_algo not in get_checksum_algorithms():
+                return jsonify({'error': f'不支持的校验算法: {manifest_algo}'}), 400
+            archive_path, task_id = create_zip_file(full_path, os.path.dirname(full_path), manifest_algo)
             
             if not os.path.exists(archive_path):
                 raise Exception("打包文件创建失败")
@@ -816,8 +2158,708 @@ def download_file(filepath):
             except Exception as e:
                 app.logger.error(f"清理临时文件失败: {str(e)}")
 
+def get_checksum_algorithms():
+    """返回当前环境可用的校验算法"""
+    algorithms = ['sha256']
+    if xxhash is not None:
+        algorithms.append('xxh64')
+    if blake3 is not None:
+        algorithms.append('blake3')
+    return algorithms
+
+def new_hasher(algo):
+    """创建指定算法的哈希对象"""
+    if algo == 'sha256':
+        return hashlib.sha256()
+    if algo == 'xxh64' and xxhash is not None:
+        return xxhash.xxh64()
+    if algo == 'blake3' and blake3 is not None:
+        return blake3.blake3()
+    raise ValueError(f"不支持的校验算法: {algo}")
+
+def hash_file(path, algo):
+    """通过mmap大块读取计算文件摘要（在进程池中执行）"""
+    hasher = new_hasher(algo)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, len(mm), CHECKSUM_READ_SIZE):
+                        hasher.update(view[offset:offset + CHECKSUM_READ_SIZE])
+                finally:
+                    view.release()
+    return hasher.hexdigest()
+
+def get_checksum_pool():
+    """获取（必要时创建）校验和计算进程池"""
+    global checksum_pool
+    with checksum_pool_lock:
+        if checksum_pool is None:
+            checksum_pool = ProcessPoolExecutor(max_workers=CHECKSUM_WORKERS)
+        return checksum_pool
+
+def reset_checksum_pool(pool):
+    """丢弃已损坏的进程池（如工作进程被OOM杀死），下次使用时重新创建"""
+    global checksum_pool
+    with checksum_pool_lock:
+        if checksum_pool is pool:
+            checksum_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def submit_to_checksum_pool(fn, tasks):
+    """将 {键: 参数元组} 提交到进程池，按完成顺序产出 (键, future)
+
+    进程池损坏时重建进程池，受影响的任务重试一次
+    """
+    retry = tasks
+    for attempt in range(2):
+        tasks, retry = retry, {}
+        pool = get_checksum_pool()
+        try:
+            futures = {pool.submit(fn, *args): key for key, args in tasks.items()}
+        except BrokenProcessPool:
+            # 已提交的任务也会随进程池一起失败，全部重试
+            if attempt:
+                raise
+            reset_checksum_pool(pool)
+            retry = tasks
+            continue
+        for future in as_completed(futures):
+            key = futures[future]
+            if isinstance(future.exception(), BrokenProcessPool):
+                reset_checksum_pool(pool)
+                if not attempt:
+                    retry[key] = tasks[key]
+                    continue
+            yield key, future
+        if not retry:
+            return
+        app.logger.warning(f"校验和进程池已损坏，重建后重试 {len(retry)} 个任务")
+
+def get_checksum_db(path):
+    """获取（必要时创建）路径所在根目录的持久化校验和缓存数据库"""
+    db_path = find_root(path)[1].get('checksum_cache', CHECKSUM_CACHE_PATH)
+    with checksum_db_lock:
+        if db_path not in checksum_dbs:
+            db = sqlite3.connect(db_path, check_same_thread=False)
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS checksums ('
+                'dev INTEGER, ino INTEGER, algo TEXT, size INTEGER, mtime_ns INTEGER, digest TEXT, '
+                'PRIMARY KEY (dev, ino, algo))'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS signatures ('
+                'dev INTEGER, ino INTEGER, block_size INTEGER, size INTEGER, mtime_ns INTEGER, blocks TEXT, '
+                'PRIMARY KEY (dev, ino, block_size))'
+            )
+            db.commit()
+            checksum_dbs[db_path] = db
+        return checksum_dbs[db_path]
+
+def get_file_checksums(paths, algo):
+    """批量获取文件摘要，按 inode/大小/修改时间 命中缓存，未命中的交给进程池计算
+
+    返回 ({路径: (os.stat_result, 摘要)}, {路径: 错误信息})，同一批路径应位于同一根目录下
+    单个文件失败不影响其他文件，已算完的摘要分批写入缓存，中途出错也不会丢失
+    """
+    if not paths:
+        return {}, {}
+    db = get_checksum_db(paths[0])
+    results = {}
+    failed = {}
+    pending = {}
+    # stat 可能很慢（如NFS上的大目录），在锁外完成，锁只用于查询缓存
+    stats = {}
+    for path in paths:
+        try:
+            stats[path] = os.stat(path)
+        except OSError as e:
+            failed[path] = str(e)
+    with checksum_db_lock:
+        for path, stat in stats.items():
+            row = db.execute(
+                'SELECT digest FROM checksums WHERE dev=? AND ino=? AND algo=? AND size=? AND mtime_ns=?',
+                (stat.st_dev, stat.st_ino, algo, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+            if row:
+                results[path] = (stat, row[0])
+            else:
+                pending[path] = stat
+
+    if pending:
+        app.logger.debug(f"计算 {len(pending)} 个文件的 {algo} 摘要")
+        computed = []
+
+        def persist():
+            with checksum_db_lock:
+                db.executemany('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)', computed)
+                db.commit()
+            computed.clear()
+
+        tasks = {path: (path, algo) for path in pending}
+        try:
+            for path, future in submit_to_checksum_pool(hash_file, tasks):
+                stat = pending[path]
+                try:
+                    digest = future.result()
+                except Exception as e:
+                    app.logger.error(f"计算摘要失败: {path}: {str(e)}")
+                    failed[path] = str(e) or type(e).__name__
+                    continue
+                results[path] = (stat, digest)
+                computed.append((stat.st_dev, stat.st_ino, algo, stat.st_size, stat.st_mtime_ns, digest))
+                if len(computed) >= CHECKSUM_PERSIST_BATCH:
+                    persist()
+        finally:
+            if computed:
+                persist()
+
+    return results, failed
+
+def build_manifest(folder_path, algo):
+    """生成目录清单，返回 ([(相对路径, 大小, 摘要)], [(相对路径, 错误信息)])，按路径排序"""
+    paths = []
+    for relpath, is_dir, _, _ in scan_tree(folder_path):
+        path = os.path.join(folder_path, relpath)
+        # 跳过管道、套接字等特殊文件，读取它们会阻塞
+        if not is_dir and os.path.isfile(path):
+            paths.append(path)
+
+    checksums, errors = get_file_checksums(paths, algo)
+    manifest = []
+    failed = []
+    for path in sorted(paths):
+        relpath = os.path.relpath(path, folder_path)
+        if path in errors:
+            failed.append((relpath, errors[path]))
+        else:
+            stat, digest = checksums[path]
+            manifest.append((relpath, stat.st_size, digest))
+    return manifest, failed
+
+def format_manifest(manifest, failed=()):
+    """将清单格式化为 sha256sum/b3sum 兼容的文本，无法计算摘要的文件以注释行列出"""
+    lines = [f"{digest}  ./{relpath}\n" for relpath, _, digest in manifest]
+    lines.extend(f"# 无法计算摘要: ./{relpath}: {error}\n" for relpath, error in failed)
+    return ''.join(lines)
+
+@app.route('/api/checksum/<path:filepath>', methods=['GET'])
+def get_checksum(filepath):
+    """获取单个文件的摘要"""
+    algo = request.args.get('algo', DEFAULT_CHECKSUM_ALGO)
+    if algo not in get_checksum_algorithms():
+        return jsonify({'error': f'不支持的校验算法: {algo}', 'algorithms': get_checksum_algorithms()}), 400
+
+    full_path = resolve_share_path(filepath)
+    if full_path is None:
+        app.logger.error(f"无效的访问路径: {filepath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    if not os.path.isfile(full_path):
+        return jsonify({'error': '文件不存在'}), 404
+
+    try:
+        checksums, failed = get_file_checksums([full_path], algo)
+    except Exception as e:
+        app.logger.error(f"计算摘要出错: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    if full_path in failed:
+        return jsonify({'error': failed[full_path]}), 500
+    stat, digest = checksums[full_path]
+
+    return jsonify({
+        'path': filepath,
+        'algorithm': algo,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'digest': digest
+    })
+
+@app.route('/api/manifest/', defaults={'dirpath': ''}, methods=['GET'])
+@app.route('/api/manifest/<path:dirpath>', methods=['GET'])
+def get_manifest(dirpath):
+    """获取目录下所有文件的摘要清单，format=text 时返回 sha256sum 兼容格式"""
+    algo = request.args.get('algo', DEFAULT_CHECKSUM_ALGO)
+    if algo not in get_checksum_algorithms():
+        return jsonify({'error': f'不支持的校验算法: {algo}', 'algorithms': get_checksum_algorithms()}), 400
+
+    full_path = resolve_share_path(dirpath)
+    if full_path is None:
+        app.logger.error(f"无效的访问路径: {dirpath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    if not os.path.isdir(full_path):
+        return jsonify({'error': '目录不存在'}), 404
+
+    try:
+        manifest, failed = build_manifest(full_path, algo)
+    except Exception as e:
+        app.logger.error(f"生成清单出错: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    if request.args.get('format') == 'text':
+        return app.response_class(format_manifest(manifest, failed), mimetype='text/plain')
+
+    return jsonify({
+        'path': dirpath,
+        'algorithm': algo,
+        'files': [
+            {'path': relpath, 'size': size, 'digest': digest}
+            for relpath, size, digest in manifest
+        ],
+        'failed': [{'path': relpath, 'error': error} for relpath, error in failed]
+    })
+
+def save_upload_session(session):
+    """将上传会话状态原子写入磁盘"""
+    os.makedirs(UPLOAD_STATE_DIR, exist_ok=True)
+    state_path = os.path.join(UPLOAD_STATE_DIR, f"{session['upload_id']}.json")
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(session, f)
+    os.replace(state_path + '.tmp', state_path)
+
+def load_upload_session(upload_id):
+    """获取上传会话，内存中没有时从磁盘恢复（服务重启后续传）"""
+    start_upload_sweeper()
+    with upload_sessions_lock:
+        if upload_id in upload_sessions:
+            return upload_sessions[upload_id]
+        try:
+            uuid.UUID(hex=upload_id)
+        except ValueError:
+            return None
+        state_path = os.path.join(UPLOAD_STATE_DIR, f'{upload_id}.json')
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path) as f:
+            session = json.load(f)
+        upload_sessions[upload_id] = session
+        return session
+
+def remove_upload_session(session):
+    """删除上传会话及其状态文件"""
+    with upload_sessions_lock:
+        upload_sessions.pop(session['upload_id'], None)
+    state_path = os.path.join(UPLOAD_STATE_DIR, f"{session['upload_id']}.json")
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+def expire_upload_sessions():
+    """清理超过 UPLOAD_SESSION_TTL 没有进展的上传会话（包括服务重启前留下的）及其临时文件"""
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    try:
+        names = os.listdir(UPLOAD_STATE_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            session = load_upload_session(name[:-len('.json')])
+        except (OSError, ValueError) as e:
+            app.logger.error(f"读取上传会话失败: {name}: {str(e)}")
+            continue
+        if session is None or session.get('updated', session['created']) > cutoff:
+            continue
+        try:
+            if os.path.exists(session['temp_path']):
+                os.remove(session['temp_path'])
+            remove_upload_session(session)
+        except OSError as e:
+            app.logger.error(f"清理过期上传会话失败: {session['upload_id']}: {str(e)}")
+            continue
+        app.logger.info(f"已清理过期上传会话: {session['upload_id']} -> {session['full_path']}")
+
+def run_upload_sweeper():
+    """后台定期清理过期上传会话"""
+    while True:
+        try:
+            expire_upload_sessions()
+        except Exception as e:
+            app.logger.error(f"清理过期上传会话出错: {str(e)}")
+        time.sleep(UPLOAD_SWEEP_INTERVAL)
+
+def start_upload_sweeper():
+    """启动过期上传会话清理线程（首次调用时执行）"""
+    global upload_sweeper_started
+    with upload_sessions_lock:
+        if upload_sweeper_started:
+            return
+        upload_sweeper_started = True
+    threading.Thread(target=run_upload_sweeper, daemon=True).start()
+
+def get_upload_status(session):
+    """汇总上传会话的进度信息"""
+    received = set(session['received'])
+    return {
+        'upload_id': session['upload_id'],
+        'path': session['path'],
+        'size': session['size'],
+        'part_size': session['part_size'],
+        'total_parts': session['total_parts'],
+        'received_parts': len(received),
+        'missing_parts': [i for i in range(session['total_parts']) if i not in received]
+    }
+
+@app.route('/api/upload', methods=['POST'])
+def create_upload():
+    """创建上传会话并预分配临时文件"""
+    start_upload_sweeper()
+    data = request.get_json(silent=True) or {}
+    filepath = data.get('path')
+    size = data.get('size')
+    part_size = data.get('part_size', UPLOAD_PART_SIZE)
+    if not filepath or not isinstance(size, int) or size < 0 or not isinstance(part_size, int) or part_size <= 0:
+        return jsonify({'error': '需要提供 path、size 以及有效的 part_size'}), 400
+
+    peer = find_peer(filepath)
+    if peer is not None:
+        return jsonify({'error': '请直接上传到数据所在节点', 'node': peer[1]}), 421
+
+    full_path = resolve_share_path(filepath)
+    if full_path is None or full_path == find_root(full_path)[1]['path']:
+        app.logger.error(f"无效的上传路径: {filepath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    root = find_root(full_path)[1]
+    if root.get('read_only'):
+        return jsonify({'error': '该根目录为只读'}), 403
+    if not parent_inside_root(full_path):
+        app.logger.error(f"上传路径经由符号链接指向共享目录之外: {filepath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    if root.get('max_upload_size') is not None and size > root['max_upload_size']:
+        return jsonify({'error': f"文件超过上传大小限制 {root['max_upload_size']} 字节"}), 413
+    if os.path.isdir(full_path):
+        return jsonify({'error': '目标路径是一个目录'}), 409
+    if os.path.exists(full_path) and not data.get('overwrite'):
+        return jsonify({'error': '文件已存在'}), 409
+
+    upload_id = uuid.uuid4().hex
+    temp_path = os.path.join(os.path.dirname(full_path), f'.{os.path.basename(full_path)}.{upload_id}.part')
+    try:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # 创建目录期间路径可能被替换为符号链接，写入前再检查一次
+        if not parent_inside_root(full_path):
+            app.logger.error(f"上传路径经由符号链接指向共享目录之外: {filepath}")
+            return jsonify({'error': '无效的文件路径'}), 403
+        # 临时文件与目标在同一目录，保证完成时可以原子重命名
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            os.truncate(fd, size)
+        finally:
+            os.close(fd)
+    except Exception as e:
+        app.logger.error(f"创建上传会话失败: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    session = {
+        'upload_id': upload_id,
+        'path': to_share_path(full_path),
+        'full_path': full_path,
+        'temp_path': temp_path,
+        'size': size,
+        'part_size': part_size,
+        'total_parts': (size + part_size - 1) // part_size,
+        'received': [],
+        'overwrite': bool(data.get('overwrite')),
+        'sha256': data.get('sha256'),
+        'created': time.time(),
+        'updated': time.time()
+    }
+    with upload_sessions_lock:
+        upload_sessions[upload_id] = session
+        save_upload_session(session)
+
+    app.logger.debug(f"创建上传会话: {upload_id} -> {full_path}")
+    return jsonify(get_upload_status(session)), 201
+
+@app.route('/api/upload/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """查询上传进度，客户端据此只补传缺失的分块"""
+    session = load_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': '上传任务不存在'}), 404
+    with upload_sessions_lock:
+        return jsonify(get_upload_status(session))
+
+@app.route('/api/upload/<upload_id>/parts/<int:index>', methods=['PUT'])
+def upload_part(upload_id, index):
+    """上传单个分块，按偏移直接写入临时文件，可并行调用"""
+    session = load_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': '上传任务不存在'}), 404
+    if index >= session['total_parts']:
+        return jsonify({'error': '分块序号超出范围'}), 400
+
+    offset = index * session['part_size']
+    expected = min(session['part_size'], session['size'] - offset)
+    if request.content_length != expected:
+        return jsonify({'error': f'分块大小应为 {expected} 字节'}), 400
+
+    written = 0
+    try:
+        fd = os.open(session['temp_path'], os.O_WRONLY)
+        try:
+            while written < expected:
+                chunk = request.stream.read(min(UPLOAD_STREAM_CHUNK, expected - written))
+                if not chunk:
+                    break
+                view = memoryview(chunk)
+                while view:
+                    n = os.pwrite(fd, view, offset + written)
+                    written += n
+                    view = view[n:]
+        finally:
+            os.close(fd)
+    except Exception as e:
+        app.logger.error(f"写入分块失败: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    if written != expected:
+        return jsonify({'error': '分块数据不完整'}), 400
+
+    with upload_sessions_lock:
+        if index not in session['received']:
+            session['received'].append(index)
+            session['updated'] = time.time()
+            save_upload_session(session)
+        return jsonify(get_upload_status(session))
+
+@app.route('/api/upload/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """所有分块到齐后校验并原子重命名为目标文件"""
+    session = load_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': '上传任务不存在'}), 404
+    with upload_sessions_lock:
+        status = get_upload_status(session)
+    if status['missing_parts']:
+        return jsonify(dict(status, error='仍有分块未上传')), 409
+    if os.path.exists(session['full_path']) and not session['overwrite']:
+        return jsonify({'error': '文件已存在'}), 409
+    if not parent_inside_root(session['full_path']):
+        app.logger.error(f"上传路径经由符号链接指向共享目录之外: {session['path']}")
+        return jsonify({'error': '无效的文件路径'}), 403
+
+    try:
+        fd = os.open(session['temp_path'], os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if session.get('sha256'):
+            checksums, failed = get_file_checksums([session['temp_path']], 'sha256')
+            if failed:
+                raise Exception(f"计算摘要失败: {failed[session['temp_path']]}")
+            _, digest = checksums[session['temp_path']]
+            if digest != session['sha256'].lower():
+                return jsonify({'error': '文件校验失败', 'digest': digest}), 422
+
+        os.replace(session['temp_path'], session['full_path'])
+    except Exception as e:
+        app.logger.error(f"完成上传失败: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    remove_upload_session(session)
+    app.logger.debug(f"上传完成: {session['full_path']}")
+    return jsonify({'path': session['path'], 'size': session['size']})
+
+@app.route('/api/upload/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """取消上传并清理临时文件"""
+    session = load_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': '上传任务不存在'}), 404
+    try:
+        if os.path.exists(session['temp_path']):
+            os.remove(session['temp_path'])
+    except Exception as e:
+        app.logger.error(f"清理上传临时文件失败: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    remove_upload_session(session)
+    return jsonify({'upload_id': upload_id, 'status': 'aborted'})
+
+def choose_block_size(size):
+    """按文件大小选择签名块大小，保证块数不超过 SYNC_TARGET_BLOCKS"""
+    block_size = SYNC_DEFAULT_BLOCK_SIZE
+    while block_size < SYNC_MAX_BLOCK_SIZE and size > block_size * SYNC_TARGET_BLOCKS:
+        block_size *= 2
+    return block_size
+
+def compute_block_signatures(path, block_size):
+    """计算文件的块签名 [(adler32弱校验, blake2b强校验)]（在进程池中执行）"""
+    blocks = []
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, len(mm), block_size):
+                        block = view[offset:offset + block_size]
+                        blocks.append((zlib.adler32(block), hashlib.blake2b(block, digest_size=16).hexdigest()))
+                        block.release()
+                finally:
+                    view.release()
+    return blocks
+
+def get_block_signatures(path, block_size):
+    """获取文件块签名，按 inode/大小/修改时间 命中缓存"""
+    db = get_checksum_db(path)
+    stat = os.stat(path)
+    key = (stat.st_dev, stat.st_ino, block_size, stat.st_size, stat.st_mtime_ns)
+    with checksum_db_lock:
+        row = db.execute(
+            'SELECT blocks FROM signatures WHERE dev=? AND ino=? AND block_size=? AND size=? AND mtime_ns=?',
+            key
+        ).fetchone()
+    if row:
+        return stat, json.loads(row[0])
+
+    _, future = next(submit_to_checksum_pool(compute_block_signatures, {path: (path, block_size)}))
+    blocks = future.result()
+    with checksum_db_lock:
+        db.execute('INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?, ?)', key + (json.dumps(blocks),))
+        db.commit()
+    return stat, blocks
+
+@app.route('/api/sync/tree/', defaults={'dirpath': ''}, methods=['GET'])
+@app.route('/api/sync/tree/<path:dirpath>', methods=['GET'])
+def get_sync_tree(dirpath):
+    """列出目录树，指定 since 时只返回该时间之后修改过的条目"""
+    full_path = resolve_share_path(dirpath)
+    if full_path is None:
+        app.logger.error(f"无效的访问路径: {dirpath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    if not os.path.isdir(full_path):
+        return jsonify({'error': '目录不存在'}), 404
+
+    try:
+        since = float(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'since 必须是时间戳'}), 400
+
+    try:
+        entries, generated = get_tree_entries(full_path)
+    except Exception as e:
+        app.logger.error(f"遍历目录出错: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'path': dirpath,
+        'generated': generated,
+        'entries': [
+            {'path': relpath, 'is_dir': is_dir, 'size': size, 'mtime': mtime}
+            for relpath, is_dir, size, mtime in entries
+            if mtime > since
+        ]
+    })
+
+@app.route('/api/sync/diff/', defaults={'dirpath': ''}, methods=['POST'])
+@app.route('/api/sync/diff/<path:dirpath>', methods=['POST'])
+def get_sync_diff(dirpath):
+    """与客户端清单 {相对路径: {size, mtime}} 比较，返回新增、修改和删除的文件"""
+    full_path = resolve_share_path(dirpath)
+    if full_path is None:
+        app.logger.error(f"无效的访问路径: {dirpath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    if not os.path.isdir(full_path):
+        return jsonify({'error': '目录不存在'}), 404
+
+    data = request.get_json(silent=True) or {}
+    client_entries = data.get('entries')
+    if not isinstance(client_entries, dict):
+        return jsonify({'error': '需要提供 entries 清单'}), 400
+    for relpath, client in client_entries.items():
+        if not (isinstance(client, dict)
+                and all(isinstance(client.get(key), (int, float)) and not isinstance(client.get(key), bool)
+                        for key in ('size', 'mtime'))):
+            return jsonify({'error': f'清单条目格式错误，需要数值 size 和 mtime: {relpath}'}), 400
+
+    try:
+        entries = scan_tree(full_path)
+    except Exception as e:
+        app.logger.error(f"遍历目录出错: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    added, modified = [], []
+    server_files = set()
+    for relpath, is_dir, size, mtime in entries:
+        if is_dir:
+            continue
+        server_files.add(relpath)
+        item = {'path': relpath, 'size': size, 'mtime': mtime}
+        client = client_entries.get(relpath)
+        if client is None:
+            added.append(item)
+        elif client['size'] != size or int(client['mtime']) != int(mtime):
+            modified.append(item)
+
+    return jsonify({
+        'path': dirpath,
+        'added': added,
+        'modified': modified,
+        'removed': sorted(relpath for relpath in client_entries if relpath not in server_files)
+    })
+
+@app.route('/api/sync/signature/<path:filepath>', methods=['GET'])
+def get_sync_signature(filepath):
+    """获取文件的滚动校验块签名，客户端比对后通过 Range 请求只下载变化的块"""
+    full_path = resolve_share_path(filepath)
+    if full_path is None:
+        app.logger.error(f"无效的访问路径: {filepath}")
+        return jsonify({'error': '无效的文件路径'}), 403
+    if not os.path.isfile(full_path):
+        return jsonify({'error': '文件不存在'}), 404
+
+    try:
+        block_size = int(request.args.get('block_size') or choose_block_size(os.path.getsize(full_path)))
+    except ValueError:
+        return jsonify({'error': 'block_size 必须是整数'}), 400
+    if not SYNC_MIN_BLOCK_SIZE <= block_size <= SYNC_MAX_BLOCK_SIZE:
+        return jsonify({'error': f'block_size 必须在 {SYNC_MIN_BLOCK_SIZE} 到 {SYNC_MAX_BLOCK_SIZE} 之间'}), 400
+
+    try:
+        stat, blocks = get_block_signatures(full_path, block_size)
+    except Exception as e:
+        app.logger.error(f"计算块签名出错: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'path': filepath,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'block_size': block_size,
+        'weak': 'adler32',
+        'strong': 'blake2b-128',
+        'blocks': blocks
+    })
+
+# 通过 gunicorn 等方式启动时从环境变量读取配置
+if os.environ.get('FILE_SERVER_CONFIG'):
+    load_config(os.environ['FILE_SERVER_CONFIG'])
+    # 直接运行时命令行还可能指定 --config，由下面的 __main__ 部分加载快照
+    if __name__ != '__main__':
+        start_tree_snapshots()
+
 if __name__ == '__main__':
-    print("Starting server on port 8090...")
-    print(f"Sharing directory: {SHARE_DIR}")
+    parser = argparse.ArgumentParser(description='文件下载服务')
+    parser.add_argument('--config', help='JSON配置文件（多根目录、联邦节点）')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8088)
+    args = parser.parse_args()
+    if args.config:
+        load_config(args.config)
+
+    print(f"Starting server on port {args.port}...")
+    for name, root in get_share_roots().items():
+        print(f"Sharing directory: {root['path']}" + (f" as /{name}" if roots_mounted() else ''))
+    for peer_url in PEERS:
+        print(f"Peer node: {peer_url} ({FEDERATION_MODE})")
     print("Debug mode: ON")
-    app.run(host='0.0.0.0', port=8088, debug=True) 
\ No newline at end of file
+    # 启动时加载目录树快照并开始后台遍历；开发服务器的重载器在子进程中运行应用，父进程不需要
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_tree_snapshots()
+    app.run(host=args.host, port=args.port, debug=True) 
\ No newline at end of file
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+import file_server
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    share = tmp_path / 'share'
+    (share / 'd' / 'sub').mkdir(parents=True)
+    monkeypatch.setattr(file_server, 'SHARE_DIR', str(share))
+    monkeypatch.setattr(file_server, 'SHARE_ROOTS', {})
+    if not file_server.start_inotify():
+        pytest.skip('inotify 不可用')
+    return file_server.app.test_client(), share
+
+
+def test_etag_changes_when_subdirectory_changes(client):
+    """子目录内新增文件时父目录的列表（子目录修改时间）已变化，不能返回304"""
+    client, share = client
+    response = client.get('/d')
+    etag = response.headers['ETag']
+    assert client.get('/d', headers={'If-None-Match': etag}).status_code == 304
+
+    sub = share / 'd' / 'sub'
+    mtime_ns = os.stat(sub).st_mtime_ns
+    # 父目录的监听收不到子目录内的变化（只有子目录的修改时间改变）
+    (sub / 'new.txt').write_text('new')
+    if os.stat(sub).st_mtime_ns == mtime_ns:
+        pytest.skip('文件系统的时间精度不足以区分修改')
+
+    response = client.get('/d', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+import file_server
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    share = tmp_path / 'share'
+    outside = tmp_path / 'outside'
+    share.mkdir()
+    outside.mkdir()
+    monkeypatch.setattr(file_server, 'SHARE_DIR', str(share))
+    monkeypatch.setattr(file_server, 'SHARE_ROOTS', {})
+    monkeypatch.setattr(file_server, 'UPLOAD_STATE_DIR', str(tmp_path / 'upload_state'))
+    return file_server.app.test_client(), share, outside
+
+
+def test_upload_rejects_symlink_out_of_share(client):
+    client, share, outside = client
+    (share / 'link').symlink_to(outside)
+    response = client.post('/api/upload', json={'path': 'link/evil.txt', 'size': 4})
+    assert response.status_code == 403
+    assert os.listdir(outside) == []
+
+
+def test_complete_rejects_directory_replaced_by_symlink(client):
+    client, share, outside = client
+    (share / 'dir').mkdir()
+    upload_id = client.post('/api/upload', json={'path': 'dir/file.txt', 'size': 4}).json['upload_id']
+    assert client.put(f'/api/upload/{upload_id}/parts/0', data=b'data').status_code == 200
+
+    # 上传期间目录被换成指向共享目录外的符号链接
+    os.rename(share / 'dir', outside / 'dir')
+    (share / 'dir').symlink_to(outside / 'dir')
+    assert client.post(f'/api/upload/{upload_id}/complete').status_code == 403
+    assert not (outside / 'dir' / 'file.txt').exists()